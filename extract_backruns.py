@@ -5,14 +5,26 @@ from HyperEVM transactions.
 """
 
 import csv
+import http.client
+import io
+import itertools
 import json
 import logging
 import os
+import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import urllib.request
+import urllib.error
+import urllib.parse
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json produces the same records
+    orjson = None
 
 # ---------------------------------------------------------------------------
 # Config
@@ -24,11 +36,30 @@ if not RPC_URL:
 TARGET_CONTRACT = "0x74c51815f070803d53bb6879df6fc1648d741212"  # lowercase
 BACKRUN_TOPIC0 = "0x4866868bf8ccc56c236dc0ed3f2d82a498301866dc9edbf731a9b2b4c8716fd7"
 
+# logsBloom bits set by TARGET_CONTRACT and BACKRUN_TOPIC0: the low 11 bits of
+# the first three byte pairs of each one's keccak256. Recompute if either
+# constant changes.
+TARGET_CONTRACT_BLOOM_BITS = (1984, 1889, 1800)
+BACKRUN_TOPIC0_BLOOM_BITS = (946, 589, 1460)
+BACKRUN_BLOOM_MASK = sum(1 << b for b in TARGET_CONTRACT_BLOOM_BITS + BACKRUN_TOPIC0_BLOOM_BITS)
+
 OUT_DIR = Path(__file__).parent / "out"
 OUT_DIR.mkdir(exist_ok=True)
 
 TX_HASHES_FILE = Path(__file__).parent / "tx_hashes.txt"
 
+OUT_BUFFER_SIZE = 1 << 20  # bytes of write buffering per output file
+
+# Block timestamps and tx fields survive across runs here
+RPC_CACHE_FILE = OUT_DIR / "rpc_cache.sqlite"
+RPC_CACHE_COMMIT_EVERY = 500  # txs between cache commits
+
+# Also write backruns.parquet (requires pyarrow)
+OUTPUT_PARQUET = os.environ.get("OUTPUT_PARQUET") == "1"
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "16"))  # txs in flight
+
 MAX_RETRIES = 5
 BACKOFF_BASE = 1.5  # seconds
 
@@ -40,7 +71,7 @@ V3_SWAP_TOPIC0 = "0xc42079f94a6350d7e6235f29174924f928cc2ac818eb64fed8004e115fbc
 # Custom swap topic for this tx set
 CUSTOM_SWAP_TOPIC0 = "0x121cb44ee54098b1a04743c487e7460d8dd429b27f88b1f4d4767396e1a59f79"
 
-SWAP_TOPICS = {V3_SWAP_TOPIC0, CUSTOM_SWAP_TOPIC0}
+SWAP_TOPICS = frozenset({V3_SWAP_TOPIC0, CUSTOM_SWAP_TOPIC0})
 
 logging.basicConfig(
     level=logging.INFO,
@@ -49,27 +80,83 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
+# ---------------------------------------------------------------------------
+# JSON helpers
+# ---------------------------------------------------------------------------
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_record(f, rec: dict):
+    """Append one JSONL record to a binary file."""
+    f.write(json_dumps(rec))
+    f.write(b"\n")
+
+
 # ---------------------------------------------------------------------------
 # RPC helpers
 # ---------------------------------------------------------------------------
-_rpc_id = 0
+# next() on a count is atomic under the GIL, so concurrent workers never
+# reuse an id (which would scramble batch responses)
+_rpc_id = itertools.count(1)
+
+
+_rpc_url = urllib.parse.urlsplit(RPC_URL)
+_rpc_path = (_rpc_url.path or "/") + (f"?{_rpc_url.query}" if _rpc_url.query else "")
+# One keep-alive connection per worker thread, so calls after the first
+# skip the TCP/TLS handshake.
+_conn_local = threading.local()
+
+
+def _connection(fresh: bool = False) -> http.client.HTTPConnection:
+    conn = getattr(_conn_local, "conn", None)
+    if conn is None or fresh:
+        if conn is not None:
+            conn.close()
+        if _rpc_url.scheme == "https":
+            conn = http.client.HTTPSConnection(_rpc_url.hostname, _rpc_url.port, timeout=30)
+        else:
+            conn = http.client.HTTPConnection(_rpc_url.hostname, _rpc_url.port, timeout=30)
+        _conn_local.conn = conn
+    return conn
+
+
+def _post(data: bytes):
+    headers = {"Content-Type": "application/json"}
+    for fresh in (False, True):
+        conn = _connection(fresh)
+        try:
+            conn.request("POST", _rpc_path, body=data, headers=headers)
+            resp = conn.getresponse()
+            raw = resp.read()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server dropped an idle keep-alive connection; reconnect once
+            if fresh:
+                raise
+        except Exception:
+            # Don't reuse a connection that may still have a response in flight
+            conn.close()
+            raise
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(RPC_URL, resp.status, resp.reason, resp.headers, None)
+    return json_loads(raw)
 
 
 def rpc_call(method: str, params: list, retries: int = MAX_RETRIES):
-    global _rpc_id
-    _rpc_id += 1
-    payload = {"jsonrpc": "2.0", "id": _rpc_id, "method": method, "params": params}
-    data = json.dumps(payload).encode("utf-8")
+    payload = {"jsonrpc": "2.0", "id": next(_rpc_id), "method": method, "params": params}
+    data = json_dumps(payload)
     for attempt in range(retries):
         try:
-            req = urllib.request.Request(
-                RPC_URL,
-                data=data,
-                headers={"Content-Type": "application/json"},
-                method="POST",
-            )
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                body = json.loads(resp.read().decode("utf-8"))
+            body = _post(data)
             if "error" in body:
                 raise RuntimeError(f"RPC error: {body['error']}")
             return body.get("result")
@@ -82,26 +169,159 @@ def rpc_call(method: str, params: list, retries: int = MAX_RETRIES):
                 raise
 
 
-def get_receipt(tx_hash: str):
-    return rpc_call("eth_getTransactionReceipt", [tx_hash])
+# Runs the calls of a would-be batch concurrently when the endpoint doesn't
+# accept batches. Separate from main()'s tx pool so workers never wait on
+# their own pool.
+_single_call_pool = ThreadPoolExecutor(max_workers=8)
+
 
+def _rpc_calls(calls: list, retries: int) -> list:
+    """Issue (method, params) calls individually but in parallel, in call order."""
+    return list(_single_call_pool.map(lambda c: rpc_call(c[0], c[1], retries), calls))
 
-def get_tx(tx_hash: str):
-    return rpc_call("eth_getTransactionByHash", [tx_hash])
 
+class BatchRejected(Exception):
+    """The endpoint does not accept JSON-RPC batch arrays."""
 
-def get_block(block_num_hex: str):
-    return rpc_call("eth_getBlockByNumber", [block_num_hex, False])
 
+# Flipped off the first time the endpoint rejects a batch.
+_batch_supported = True
 
-def get_logs(from_block_hex: str, to_block_hex: str, address: str, topics: list):
-    filt = {
+
+def rpc_batch(calls: list, retries: int = MAX_RETRIES) -> list:
+    """
+    Send (method, params) calls as one JSON-RPC batch and return their results
+    in call order. Falls back to one rpc_call per entry if the endpoint turns
+    out not to support batches.
+    """
+    global _batch_supported
+    if len(calls) <= 1:
+        return [rpc_call(method, params, retries) for method, params in calls]
+    if not _batch_supported:
+        return _rpc_calls(calls, retries)
+
+    payload = [
+        {"jsonrpc": "2.0", "id": next(_rpc_id), "method": method, "params": params}
+        for method, params in calls
+    ]
+    data = json_dumps(payload)
+    for attempt in range(retries):
+        try:
+            try:
+                body = _post(data)
+            except urllib.error.HTTPError as e:
+                # 429 is rate limiting, not a verdict on batching
+                if 400 <= e.code < 500 and e.code != 429:
+                    raise BatchRejected(f"HTTP {e.code}") from e
+                raise
+            if not isinstance(body, list):
+                raise BatchRejected(f"non-array response: {str(body)[:200]}")
+            by_id = {r.get("id"): r for r in body}
+            results = []
+            for p in payload:
+                r = by_id.get(p["id"])
+                if r is None:
+                    raise RuntimeError(f"RPC batch response missing id {p['id']}")
+                if "error" in r:
+                    raise RuntimeError(f"RPC error: {r['error']}")
+                results.append(r.get("result"))
+            return results
+        except BatchRejected as e:
+            log.warning("RPC endpoint rejected batch request (%s), using single calls", e)
+            _batch_supported = False
+            return _rpc_calls(calls, retries)
+        except Exception as e:
+            if attempt < retries - 1:
+                wait = BACKOFF_BASE ** (attempt + 1)
+                log.warning("RPC batch attempt %d failed (%s), retrying in %.1fs", attempt + 1, e, wait)
+                time.sleep(wait)
+            else:
+                raise
+
+
+def logs_filter(from_block_hex: str, to_block_hex: str, address: str | list, topics: list) -> dict:
+    return {
         "fromBlock": from_block_hex,
         "toBlock": to_block_hex,
         "address": address,
         "topics": topics,
     }
-    return rpc_call("eth_getLogs", [filt])
+
+
+# ---------------------------------------------------------------------------
+# RPC result cache
+# ---------------------------------------------------------------------------
+class RpcCache:
+    """
+    RPC results shared by all workers for the run. Block timestamps and the
+    tx fields we use are also persisted to SQLite, so re-runs (including a
+    resume after a crash) don't fetch them again; swap logs stay in memory.
+
+    Workers only touch the dicts and the pending lists; persist() and close()
+    must be called from the thread that opened the cache.
+    """
+
+    def __init__(self, path: Path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blocks (hex TEXT PRIMARY KEY, timestamp INTEGER NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS txs"
+            " (hash TEXT PRIMARY KEY, to_addr TEXT NOT NULL, input_selector TEXT NOT NULL)"
+        )
+        # block hex -> unix timestamp, or None if the node didn't return the block
+        self.block_times: dict[str, int | None] = dict(
+            self.db.execute("SELECT hex, timestamp FROM blocks")
+        )
+        # tx hash -> (to, input selector)
+        self.txs: dict[str, tuple[str, str]] = {
+            h: (to, sel) for h, to, sel in self.db.execute("SELECT hash, to_addr, input_selector FROM txs")
+        }
+        # (pool, block_number) -> swap logs
+        self.logs: dict[tuple[str, int], list] = {}
+        # (tx hash, log index) -> (lowercased topic0, decoded swap)
+        self.swaps: dict[tuple[str, str], tuple[str, dict | None]] = {}
+        self._lock = threading.Lock()
+        self._new_blocks: list[tuple[str, int]] = []
+        self._new_txs: list[tuple[str, str, str]] = []
+
+    def add_block(self, block_hex: str, block: dict | None):
+        ts = hex_to_int(block["timestamp"]) if block else None
+        self.block_times[block_hex] = ts
+        # Missing blocks may just not exist yet; only persist real ones
+        if ts is not None:
+            with self._lock:
+                self._new_blocks.append((block_hex, ts))
+
+    def add_tx(self, tx_hash: str, to: str, input_selector: str):
+        self.txs[tx_hash] = (to, input_selector)
+        with self._lock:
+            self._new_txs.append((tx_hash, to, input_selector))
+
+    def decoded_swap(self, sl: dict) -> tuple[str, dict | None]:
+        """
+        topic0 and decoded payload of a swap log. A log reached from several
+        origin txs (neighbouring backruns on one pool) is decoded only once.
+        """
+        key = (sl.get("transactionHash"), sl.get("logIndex"))
+        hit = self.swaps.get(key)
+        if hit is None:
+            t0 = sl["topics"][0].lower()
+            hit = self.swaps[key] = (t0, decode_swap(sl, t0))
+        return hit
+
+    def persist(self):
+        with self._lock:
+            new_blocks, self._new_blocks = self._new_blocks, []
+            new_txs, self._new_txs = self._new_txs, []
+        self.db.executemany("INSERT OR IGNORE INTO blocks VALUES (?, ?)", new_blocks)
+        self.db.executemany("INSERT OR IGNORE INTO txs VALUES (?, ?, ?)", new_txs)
+        self.db.commit()
+
+    def close(self):
+        self.persist()
+        self.db.close()
 
 
 # ---------------------------------------------------------------------------
@@ -121,13 +341,26 @@ def uint256_from_bytes(b: bytes) -> int:
     return int.from_bytes(b, "big")
 
 
-def int256_from_bytes(b: bytes) -> int:
-    v = int.from_bytes(b, "big")
+def to_int256(v: int) -> int:
+    """Reinterpret an unsigned 256-bit word as two's-complement signed."""
     if v >= (1 << 255):
         v -= 1 << 256
     return v
 
 
+_WORD_MASK = (1 << 256) - 1
+
+
+def abi_words(data: bytes, n: int) -> list[int]:
+    """
+    First n 32-byte ABI words of data as unsigned ints. One int.from_bytes
+    over the whole span plus shifts is cheaper than slicing and converting
+    each word separately.
+    """
+    big = int.from_bytes(data[: 32 * n], "big")
+    return [(big >> (256 * (n - 1 - i))) & _WORD_MASK for i in range(n)]
+
+
 def addr_from_topic(topic: str) -> str:
     """Last 20 bytes of a bytes32 topic -> 0x-prefixed lowercase address."""
     return "0x" + topic[-40:].lower()
@@ -138,15 +371,16 @@ def decode_v3_swap(log_entry: dict) -> dict | None:
         data = hex_to_bytes(log_entry["data"])
         if len(data) < 160:
             return None
+        amount0, amount1, sqrt_price_x96, liquidity, tick = abi_words(data, 5)
         return {
             "type": "v3",
             "sender": addr_from_topic(log_entry["topics"][1]),
             "recipient": addr_from_topic(log_entry["topics"][2]),
-            "amount0": str(int256_from_bytes(data[0:32])),
-            "amount1": str(int256_from_bytes(data[32:64])),
-            "sqrtPriceX96": str(uint256_from_bytes(data[64:96])),
-            "liquidity": str(uint256_from_bytes(data[96:128])),
-            "tick": str(int256_from_bytes(data[128:160])),
+            "amount0": str(to_int256(amount0)),
+            "amount1": str(to_int256(amount1)),
+            "sqrtPriceX96": str(sqrt_price_x96),
+            "liquidity": str(liquidity),
+            "tick": str(to_int256(tick)),
         }
     except Exception as e:
         return {"decode_error": str(e)}
@@ -164,17 +398,16 @@ def decode_custom_swap(log_entry: dict) -> dict | None:
         if len(topics) >= 3:
             result["topic2_addr"] = addr_from_topic(topics[2])
         # Store raw data words
-        n_words = len(data) // 32
-        for i in range(min(n_words, 8)):
-            word = data[i * 32 : (i + 1) * 32]
-            result[f"word{i}"] = str(int256_from_bytes(word))
+        n_words = min(len(data) // 32, 8)
+        for i, word in enumerate(abi_words(data, n_words)):
+            result[f"word{i}"] = str(to_int256(word))
         return result
     except Exception as e:
         return {"decode_error": str(e)}
 
 
-def decode_swap(log_entry: dict) -> dict | None:
-    t0 = log_entry["topics"][0].lower()
+def decode_swap(log_entry: dict, t0: str) -> dict | None:
+    """Decode a swap log given its already-lowercased topic0."""
     if t0 == V3_SWAP_TOPIC0:
         return decode_v3_swap(log_entry)
     if t0 == CUSTOM_SWAP_TOPIC0:
@@ -182,6 +415,26 @@ def decode_swap(log_entry: dict) -> dict | None:
     return None
 
 
+def bloom_contains(bloom_hex: str, mask: int) -> bool:
+    """True if every bit of mask is set in a 2048-bit logsBloom."""
+    return int(bloom_hex, 16) & mask == mask
+
+
+def block_time_str(ts: int | None) -> str:
+    """ISO-8601 UTC form of a block timestamp, or "" if the block is unknown."""
+    if ts is None:
+        return ""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def block_tx(block: dict | None, tx_index: int, tx_hash: str) -> dict | None:
+    """Transaction tx_hash from a block fetched with full transactions."""
+    txs = block.get("transactions", []) if block else []
+    if tx_index < len(txs) and txs[tx_index].get("hash", "").lower() == tx_hash:
+        return txs[tx_index]
+    return next((t for t in txs if t.get("hash", "").lower() == tx_hash), None)
+
+
 def raw_log(log_entry: dict) -> dict:
     return {
         "address": log_entry.get("address", "").lower(),
@@ -212,56 +465,165 @@ def parse_backrun_log(log_entry: dict) -> dict:
     }
 
 
+# ---------------------------------------------------------------------------
+# Parquet output
+# ---------------------------------------------------------------------------
+class BackrunParquetWriter:
+    """
+    Buffers backrun records column-wise and writes them to Parquet one row
+    group at a time. Low-cardinality columns are dictionary-encoded; the raw
+    backrun log stays in backruns.jsonl only.
+    """
+
+    def __init__(self, path: Path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        category = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([
+            ("tx_hash", pa.string()),
+            ("block_number", pa.int64()),
+            ("block_time", pa.string()),
+            ("backrun_log_index", pa.int64()),
+            ("pool", category),
+            ("profit_raw", pa.string()),  # uint256, kept as decimal string
+            ("profit_token", category),
+            ("tx_to", category),
+            ("tx_input_selector", category),
+        ])
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self._columns = {name: [] for name in self.schema.names}
+        self._rows = 0
+
+    def add(self, rec: dict):
+        for name, values in self._columns.items():
+            values.append(rec[name])
+        self._rows += 1
+        if self._rows >= PARQUET_ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        batch = self._pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        for values in self._columns.values():
+            values.clear()
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
 # ---------------------------------------------------------------------------
 # Main processing
 # ---------------------------------------------------------------------------
-def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
+def process_tx(tx_hash: str, writers: dict, cache: RpcCache, errors_f):
     """Process a single transaction."""
-    receipt = get_receipt(tx_hash)
+    receipt = rpc_call("eth_getTransactionReceipt", [tx_hash])
     if receipt is None:
         err = {"tx_hash": tx_hash, "reason": "receipt_null"}
-        errors_f.write(json.dumps(err) + "\n")
+        write_record(errors_f, err)
         return 0
 
-    # Fetch the transaction object for to address and input
-    tx_obj = get_tx(tx_hash)
-    tx_to = (tx_obj.get("to") or "").lower() if tx_obj else ""
-    tx_input_raw = tx_obj.get("input", "0x") if tx_obj else "0x"
-    # First 10 chars = "0x" + 4-byte selector (8 hex chars)
-    tx_input_selector = tx_input_raw[:10].lower() if len(tx_input_raw) >= 10 else tx_input_raw.lower()
+    # The receipt carries the to address. The input selector is cached, or
+    # read from the tx's block once we know it's a backrun (see below).
+    tx_to = (receipt.get("to") or "").lower()
+    cached_tx = cache.txs.get(tx_hash)
+    tx_input_selector = cached_tx[1] if cached_tx else None
 
     block_number = hex_to_int(receipt["blockNumber"])
     block_hex = receipt["blockNumber"]
     tx_index = hex_to_int(receipt["transactionIndex"]) if isinstance(receipt.get("transactionIndex"), str) else receipt.get("transactionIndex", 0)
 
-    # Get block timestamp for this block (cached)
-    if block_hex not in block_cache:
-        blk = get_block(block_hex)
-        block_cache[block_hex] = blk
-    block_time = ""
-    if block_cache[block_hex]:
-        ts = hex_to_int(block_cache[block_hex]["timestamp"])
-        block_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
-
     logs = receipt.get("logs", [])
 
-    # Find backrun logs
-    backrun_logs = [
-        l for l in logs
-        if l.get("address", "").lower() == TARGET_CONTRACT
-        and len(l.get("topics", [])) >= 2
-        and l["topics"][0].lower() == BACKRUN_TOPIC0
-    ]
+    # The receipt bloom has no false negatives, so a miss there rules the tx
+    # out without walking its logs.
+    bloom = receipt.get("logsBloom")
+    if bloom and not bloom_contains(bloom, BACKRUN_BLOOM_MASK):
+        logs = []
+
+    # One walk over the receipt: collect the backrun logs and index swap logs
+    # by pool, so each backrun looks up its own instead of rescanning
+    backrun_logs = []
+    tx_swaps_by_pool: dict[str, list[dict]] = {}
+    for l in logs:
+        topics = l.get("topics")
+        if not topics:
+            continue
+        t0 = topics[0].lower()
+        if t0 in SWAP_TOPICS:
+            tx_swaps_by_pool.setdefault(l.get("address", "").lower(), []).append(l)
+        elif (
+            t0 == BACKRUN_TOPIC0
+            and len(topics) >= 2
+            and l.get("address", "").lower() == TARGET_CONTRACT
+        ):
+            backrun_logs.append(l)
 
     if not backrun_logs:
         err = {"tx_hash": tx_hash, "reason": "no_backrun_log"}
-        errors_f.write(json.dumps(err) + "\n")
+        write_record(errors_f, err)
         return 0
 
+    parsed_logs = [(bl, parse_backrun_log(bl)) for bl in backrun_logs]
+    pools = list(dict.fromkeys(parsed["pool"] for _, parsed in parsed_logs))
+
+    # Everything else only depends on the receipt, so fetch it in one batch:
+    # uncached block headers for block..block+3, plus a single eth_getLogs
+    # covering every backrun pool whose swaps in that range aren't cached yet.
+    # Logs are bucketed client-side by (pool, block number); neighbouring txs
+    # on the same pool then hit the cache instead of re-querying.
+    # The tx's own block is fetched with full transactions if we still need
+    # the tx input, which saves a separate eth_getTransactionByHash.
+    block_hexes = [block_hex] + [hex(block_number + offset) for offset in (1, 2, 3)]
+    need_input = tx_input_selector is None
+    missing_blocks = [
+        h for h in block_hexes
+        if h not in cache.block_times or (need_input and h == block_hex)
+    ]
+    calls = [("eth_getBlockByNumber", [h, need_input and h == block_hex]) for h in missing_blocks]
+    missing_logs = [
+        (pool, nb)
+        for pool in pools
+        for nb in range(block_number, block_number + 4)
+        if (pool, nb) not in cache.logs
+    ]
+    if missing_logs:
+        miss_pools = list(dict.fromkeys(pool for pool, _ in missing_logs))
+        lo = min(nb for _, nb in missing_logs)
+        hi = max(nb for _, nb in missing_logs)
+        calls.append((
+            "eth_getLogs",
+            [logs_filter(hex(lo), hex(hi), miss_pools, [[V3_SWAP_TOPIC0, CUSTOM_SWAP_TOPIC0]])],
+        ))
+    results = rpc_batch(calls)
+    for h, blk in zip(missing_blocks, results):
+        cache.add_block(h, blk)
+        if need_input and h == block_hex:
+            tx_obj = block_tx(blk, tx_index, tx_hash)
+            # First 10 chars = "0x" + 4-byte selector (8 hex chars)
+            tx_input_selector = (tx_obj.get("input", "0x") if tx_obj else "0x")[:10].lower()
+            if tx_obj:
+                cache.add_tx(tx_hash, tx_to, tx_input_selector)
+    if missing_logs:
+        fetched = {(pool, nb): [] for pool in miss_pools for nb in range(lo, hi + 1)}
+        for sl in results[-1] or []:
+            key = (sl.get("address", "").lower(), hex_to_int(sl["blockNumber"]))
+            if key in fetched:
+                fetched[key].append(sl)
+        cache.logs.update(fetched)
+
+    # Tx-level values shared by every backrun log below
+    block_time = block_time_str(cache.block_times[block_hex])
+    next_blocks = [(hex_to_int(h), block_time_str(cache.block_times[h])) for h in block_hexes[1:]]
+
     backrun_count = 0
 
-    for bl in backrun_logs:
-        parsed = parse_backrun_log(bl)
+    for bl, parsed in parsed_logs:
         pool = parsed["pool"]
         bl_index = bl.get("logIndex")
         if isinstance(bl_index, str):
@@ -280,19 +642,14 @@ def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
             "tx_input_selector": tx_input_selector,
             "raw_backrun_log": raw_log(bl),
         }
-        writers["backruns"].write(json.dumps(backrun_rec) + "\n")
+        write_record(writers["backruns"], backrun_rec)
+        writers["backrun_rows"].append(backrun_rec)
         backrun_count += 1
 
         # --- Same-tx swaps on this pool ---
         n_tx_swaps = 0
-        for sl in logs:
-            if sl.get("address", "").lower() != pool:
-                continue
-            if not sl.get("topics"):
-                continue
-            if sl["topics"][0].lower() not in SWAP_TOPICS:
-                continue
-            decoded = decode_swap(sl)
+        for sl in tx_swaps_by_pool.get(pool, ()):
+            sl_t0, decoded = cache.decoded_swap(sl)
             sl_index = sl.get("logIndex")
             if isinstance(sl_index, str):
                 sl_index = hex_to_int(sl_index)
@@ -302,17 +659,17 @@ def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
                 "pool": pool,
                 "swap_tx_hash": tx_hash,
                 "swap_log_index": sl_index,
-                "swap_topic0": sl["topics"][0].lower(),
+                "swap_topic0": sl_t0,
                 "decoded": decoded,
                 "raw_log": raw_log(sl),
             }
-            writers["tx_swaps"].write(json.dumps(swap_rec) + "\n")
+            write_record(writers["tx_swaps"], swap_rec)
             n_tx_swaps += 1
 
         # --- Same-block-after-tx swaps on this pool ---
         # Use eth_getLogs on the same block, then filter to only txs AFTER ours
         n_same_block_after = 0
-        same_block_swap_logs = get_logs(block_hex, block_hex, pool, [[V3_SWAP_TOPIC0, CUSTOM_SWAP_TOPIC0]])
+        same_block_swap_logs = cache.logs[(pool, block_number)]
         if same_block_swap_logs:
             for sl in same_block_swap_logs:
                 # Skip logs from our own transaction
@@ -323,7 +680,7 @@ def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
                 sl_tx_index = hex_to_int(sl["transactionIndex"]) if isinstance(sl.get("transactionIndex"), str) else sl.get("transactionIndex", 0)
                 if sl_tx_index <= tx_index:
                     continue
-                decoded = decode_swap(sl)
+                sl_t0, decoded = cache.decoded_swap(sl)
                 sl_index = sl.get("logIndex")
                 if isinstance(sl_index, str):
                     sl_index = hex_to_int(sl_index)
@@ -336,35 +693,22 @@ def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
                     "swap_tx_hash": sl_tx_hash,
                     "swap_tx_index": sl_tx_index,
                     "swap_log_index": sl_index,
-                    "swap_topic0": sl["topics"][0].lower(),
+                    "swap_topic0": sl_t0,
                     "decoded": decoded,
                     "raw_log": raw_log(sl),
                 }
-                writers["same_block_swaps"].write(json.dumps(sb_rec) + "\n")
+                write_record(writers["same_block_swaps"], sb_rec)
                 n_same_block_after += 1
 
         # --- Next 3 blocks swaps (block+1, block+2, block+3) ---
         n_next_swaps = 0
-        for offset in (1, 2, 3):
-            nb = block_number + offset
-            nb_hex = hex(nb)
-
-            # Fetch block for timestamp (cached)
-            if nb_hex not in block_cache:
-                blk = get_block(nb_hex)
-                block_cache[nb_hex] = blk
-            nb_time = ""
-            if block_cache[nb_hex]:
-                ts = hex_to_int(block_cache[nb_hex]["timestamp"])
-                nb_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
-
-            # eth_getLogs for swaps on pool in this block
-            swap_logs = get_logs(nb_hex, nb_hex, pool, [[V3_SWAP_TOPIC0, CUSTOM_SWAP_TOPIC0]])
+        for nb, nb_time in next_blocks:
+            swap_logs = cache.logs[(pool, nb)]
             if not swap_logs:
                 continue
 
             for sl in swap_logs:
-                decoded = decode_swap(sl)
+                sl_t0, decoded = cache.decoded_swap(sl)
                 sl_index = sl.get("logIndex")
                 if isinstance(sl_index, str):
                     sl_index = hex_to_int(sl_index)
@@ -377,11 +721,11 @@ def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
                     "observed_block_time": nb_time,
                     "swap_tx_hash": sl.get("transactionHash", "").lower(),
                     "swap_log_index": sl_index,
-                    "swap_topic0": sl["topics"][0].lower(),
+                    "swap_topic0": sl_t0,
                     "decoded": decoded,
                     "raw_log": raw_log(sl),
                 }
-                writers["next_swaps"].write(json.dumps(nb_rec) + "\n")
+                write_record(writers["next_swaps"], nb_rec)
                 n_next_swaps += 1
 
         # Summary row
@@ -395,6 +739,29 @@ def process_tx(tx_hash: str, writers: dict, block_cache: dict, errors_f):
     return backrun_count
 
 
+def run_tx(tx_hash: str, cache: RpcCache):
+    """
+    Run process_tx against private in-memory buffers so concurrent workers
+    never interleave records. Returns (backrun_count, buffers by writer key,
+    backrun records).
+    """
+    bufs = {
+        key: io.BytesIO()
+        for key in ("backruns", "tx_swaps", "same_block_swaps", "next_swaps", "errors")
+    }
+    bufs["summary"] = io.StringIO()
+    backrun_rows = []
+    writers = dict(bufs, summary=csv.writer(bufs["summary"]), backrun_rows=backrun_rows)
+    try:
+        n = process_tx(tx_hash, writers, cache, bufs["errors"])
+    except Exception as e:
+        log.error("Failed tx %s: %s", tx_hash, e)
+        err = {"tx_hash": tx_hash, "reason": str(e)}
+        write_record(bufs["errors"], err)
+        n = 0
+    return n, bufs, backrun_rows
+
+
 def main():
     # Read tx hashes
     tx_hashes = []
@@ -408,12 +775,12 @@ def main():
     log.info("V3 Swap topic0: %s", V3_SWAP_TOPIC0)
 
     # Open output files
-    backruns_f = open(OUT_DIR / "backruns.jsonl", "w")
-    tx_swaps_f = open(OUT_DIR / "tx_pool_swaps.jsonl", "w")
-    same_block_f = open(OUT_DIR / "same_block_pool_swaps.jsonl", "w")
-    next_swaps_f = open(OUT_DIR / "next_blocks_pool_swaps.jsonl", "w")
-    errors_f = open(OUT_DIR / "errors.jsonl", "w")
-    summary_f = open(OUT_DIR / "summary.csv", "w", newline="")
+    backruns_f = open(OUT_DIR / "backruns.jsonl", "wb", buffering=OUT_BUFFER_SIZE)
+    tx_swaps_f = open(OUT_DIR / "tx_pool_swaps.jsonl", "wb", buffering=OUT_BUFFER_SIZE)
+    same_block_f = open(OUT_DIR / "same_block_pool_swaps.jsonl", "wb", buffering=OUT_BUFFER_SIZE)
+    next_swaps_f = open(OUT_DIR / "next_blocks_pool_swaps.jsonl", "wb", buffering=OUT_BUFFER_SIZE)
+    errors_f = open(OUT_DIR / "errors.jsonl", "wb", buffering=OUT_BUFFER_SIZE)
+    summary_f = open(OUT_DIR / "summary.csv", "w", newline="", buffering=OUT_BUFFER_SIZE)
     summary_w = csv.writer(summary_f)
     summary_w.writerow([
         "tx_hash", "block_number", "pool",
@@ -422,37 +789,47 @@ def main():
         "n_swaps_in_tx", "n_swaps_same_block_after", "n_swaps_next_3_blocks",
     ])
 
-    writers = {
+    files = {
         "backruns": backruns_f,
         "tx_swaps": tx_swaps_f,
         "same_block_swaps": same_block_f,
         "next_swaps": next_swaps_f,
-        "summary": summary_w,
+        "errors": errors_f,
+        "summary": summary_f,
     }
 
-    block_cache: dict = {}
+    parquet = BackrunParquetWriter(OUT_DIR / "backruns.parquet") if OUTPUT_PARQUET else None
+
+    cache = RpcCache(RPC_CACHE_FILE)
+    log.info("RPC cache: %d blocks, %d txs", len(cache.block_times), len(cache.txs))
     total_backruns = 0
     errors = 0
 
-    for i, tx_hash in enumerate(tx_hashes):
-        try:
-            n = process_tx(tx_hash, writers, block_cache, errors_f)
+    # Workers only fetch and decode; records are written here, in input order.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = pool.map(run_tx, tx_hashes, itertools.repeat(cache))
+        for i, (n, bufs, backrun_rows) in enumerate(results):
+            for key, buf in bufs.items():
+                files[key].write(buf.getvalue())
+            if parquet is not None:
+                for rec in backrun_rows:
+                    parquet.add(rec)
             total_backruns += n
             if n == 0:
                 errors += 1
-        except Exception as e:
-            log.error("Failed tx %s: %s", tx_hash, e)
-            err = {"tx_hash": tx_hash, "reason": str(e)}
-            errors_f.write(json.dumps(err) + "\n")
-            errors += 1
+            if (i + 1) % RPC_CACHE_COMMIT_EVERY == 0:
+                cache.persist()
 
-        if (i + 1) % 10 == 0 or (i + 1) == len(tx_hashes):
-            log.info("Processed %d/%d txs, backruns found: %d, errors: %d",
-                     i + 1, len(tx_hashes), total_backruns, errors)
+            if (i + 1) % 10 == 0 or (i + 1) == len(tx_hashes):
+                log.info("Processed %d/%d txs, backruns found: %d, errors: %d",
+                         i + 1, len(tx_hashes), total_backruns, errors)
 
     # Flush and close
     for f in (backruns_f, tx_swaps_f, same_block_f, next_swaps_f, errors_f, summary_f):
         f.close()
+    if parquet is not None:
+        parquet.close()
+    cache.close()
 
     log.info("Done. Outputs in %s", OUT_DIR)
     log.info("  backruns.jsonl: %d entries", total_backruns)